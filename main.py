@@ -1,8 +1,23 @@
 import argparse
-import dns.resolver
+import atexit
+import contextlib
+import functools
+import ipaddress
+import itertools
+import json
+import re
+import secrets
+import shutil
+import socket
 import sys
 import os
-from urllib.parse import urlparse
+import tempfile
+import time
+
+try:
+    import fcntl
+except ImportError:  # Not available on Windows
+    fcntl = None
 
 # Map class names to CIDR notations
 CLASS_TO_CIDR = {
@@ -12,53 +27,432 @@ CLASS_TO_CIDR = {
     "HOST": "/32",  # Synonym for /32
 }
 
-def resolve_domains(domains_with_cidr, default_ip_class):
+# Matches blank lines and comment lines (starting with '#' or '//') in domain files
+SKIP_LINE = re.compile(rb'^\s*(?:#|//|$)')
+
+# Classifies the WireGuard config lines that update_config cares about
+CONFIG_LINE = re.compile(rb'\s*(?:(?P<peer>\[Peer\]\s*$)|(?P<section>\[)|(?P<allowed_ips>AllowedIPs =))')
+
+# Buffer size for reading the template and writing the updated config
+CONFIG_BUFFER_SIZE = 1 << 20
+
+# Upper bound on in-flight DNS queries, to avoid flooding the upstream resolver
+MAX_CONCURRENT_QUERIES = 256
+# Total time in seconds allowed for a single domain lookup
+DNS_LIFETIME = 3
+# Time in seconds to wait for a pipelined UDP query before retrying it with the full resolver
+PIPELINE_TIMEOUT = 2
+# Smallest number of domains worth handing to a separate --jobs worker
+MIN_JOB_CHUNK = 32
+# Number of answers kept in the resolver's in-memory cache during a run
+RESOLVER_CACHE_SIZE = 10000
+
+# Location of the persistent DNS cache, and the longest time an entry is trusted
+DNS_CACHE_FILE = os.path.join(os.path.expanduser("~"), ".cache", "smartwg", "dns.json")
+DNS_CACHE_MAX_TTL = 300
+# How long in seconds a domain that does not exist (or has no A records) is remembered
+NEGATIVE_CACHE_TTL = 60
+
+def _load_dns_cache(cache_file):
+    """
+    Load the on-disk DNS cache, dropping any entries that have already expired or are malformed.
+    Returns an empty cache if the file is missing, unreadable or not a cache at all.
+    """
+    try:
+        with open(cache_file, 'r') as f:
+            cache = json.load(f)
+    except (OSError, ValueError):
+        return {}
+    if not isinstance(cache, dict):
+        return {}
+    now = time.time()
+    return {domain: entry for domain, entry in cache.items() if _is_valid_cache_entry(entry, now)}
+
+def _is_valid_cache_entry(entry, now):
+    """
+    Check that a DNS cache entry has an unexpired "expires" time and a list of IPv4 addresses in "ips".
+    """
+    if not isinstance(entry, dict):
+        return False
+    expires = entry.get("expires")
+    ips = entry.get("ips")
+    if not isinstance(expires, (int, float)) or isinstance(expires, bool) or expires <= now:
+        return False
+    if not isinstance(ips, list) or not all(isinstance(ip, str) for ip in ips):
+        return False
+    try:
+        for ip in ips:
+            ipaddress.IPv4Address(ip)
+    except ValueError:
+        return False
+    return True
+
+def _save_dns_cache(cache, cache_file):
+    """
+    Merge the in-memory DNS cache into the on-disk cache and write it back.
+    A lock file serializes concurrent runs so entries are not lost, and the file is
+    replaced atomically so runs reading it without the lock never see a partial write.
+    """
+    try:
+        os.makedirs(os.path.dirname(cache_file), exist_ok=True)
+        with open(cache_file + ".lock", 'w') as lock:
+            if fcntl:
+                fcntl.flock(lock, fcntl.LOCK_EX)
+            merged = _load_dns_cache(cache_file)
+            merged.update(cache)
+            _write_atomically(cache_file, json.dumps(merged).encode())
+    except OSError as e:
+        print(f"Warning: could not write DNS cache {cache_file}: {e}", file=sys.stderr)
+
+def _parse_a_response(domain, query, response):
+    """
+    Turn a DNS response into an (ips, ttl, error) tuple.
+    Names that do not exist or have no A records get NEGATIVE_CACHE_TTL, so the failure is cached too.
+    Returns None if the server failed to give a definitive answer, so the lookup can be retried.
+    """
+    import dns.rcode
+    import dns.rdatatype
+    import dns.resolver
+
+    rcode = response.rcode()
+    if rcode == dns.rcode.NXDOMAIN:
+        error = dns.resolver.NXDOMAIN(qnames=[query.question[0].name])
+        return [], NEGATIVE_CACHE_TTL, f"Failed to resolve domain {domain}: {error}"
+    if rcode != dns.rcode.NOERROR:
+        return None
+
+    rrsets = [rrset for rrset in response.answer if rrset.rdtype == dns.rdatatype.A]
+    if not rrsets:
+        error = dns.resolver.NoAnswer(response=response)
+        return [], NEGATIVE_CACHE_TTL, f"Failed to resolve domain {domain}: {error}"
+    return [str(rr) for rrset in rrsets for rr in rrset], min(rrset.ttl for rrset in rrsets), None
+
+def _resolve_pipelined(resolver, domains, max_in_flight=MAX_CONCURRENT_QUERIES):
+    """
+    Resolve domains by pipelining raw A queries over a single UDP socket to the resolver's nameserver.
+    At most max_in_flight queries are outstanding at once.
+    Returns a dict of domain -> (ips, ttl, error) for every domain that got a definitive answer.
+    Domains that time out or get a server failure are left out so they can be retried.
+    """
+    import dns.exception
+    import dns.flags
+    import dns.inet
+    import dns.message
+    import dns.query
+
+    try:
+        nameserver = next(ns for ns in resolver.nameservers if isinstance(ns, str))
+        port = resolver.port
+        family = dns.inet.af_for_address(nameserver)
+        nameserver_address = dns.inet.inet_pton(family, nameserver)
+        sock = socket.socket(family, socket.SOCK_DGRAM)
+    except (StopIteration, ValueError, OSError):
+        return {}
+
+    results = {}
+    # Single-label names need the resolver's search domains, so leave them to the fallback
+    queue = [domain for domain in domains if '.' in domain.strip('.')]
+    in_flight = {}  # query id -> (domain, query, deadline)
+    # Truncated answers are retried over TCP once the UDP loop is done, so a slow TCP
+    # exchange doesn't hold up (and time out) the replies already waiting on the socket
+    truncated = []
+
+    with sock:
+        while queue or in_flight:
+            # Keep up to max_in_flight queries outstanding on the socket
+            while queue and len(in_flight) < max_in_flight:
+                domain = queue.pop()
+                try:
+                    query = dns.message.make_query(domain, 'A')
+                except dns.exception.DNSException as e:
+                    results[domain] = [], None, f"Failed to resolve domain {domain}: {e}"
+                    continue
+                # Unpredictable ids make forged replies harder to match to a query
+                query.id = secrets.randbelow(0x10000)
+                while query.id in in_flight:
+                    query.id = secrets.randbelow(0x10000)
+                try:
+                    sock.sendto(query.to_wire(), (nameserver, port))
+                except OSError:
+                    return results
+                in_flight[query.id] = (domain, query, time.monotonic() + PIPELINE_TIMEOUT)
+
+            # Give up on queries that have waited too long
+            now = time.monotonic()
+            for query_id in [q for q, (_, _, deadline) in in_flight.items() if deadline <= now]:
+                del in_flight[query_id]
+            if not in_flight:
+                continue
+
+            sock.settimeout(min(deadline for _, _, deadline in in_flight.values()) - now)
+            try:
+                wire, source = sock.recvfrom(65535)
+            except socket.timeout:
+                continue
+            except OSError:
+                return results
+
+            # Ignore datagrams that did not come from the nameserver we queried
+            try:
+                if (dns.inet.inet_pton(family, source[0]), source[1]) != (nameserver_address, port):
+                    continue
+                response = dns.message.from_wire(wire)
+            except (ValueError, dns.exception.DNSException):
+                continue
+
+            entry = in_flight.get(response.id)
+            if entry is None or not entry[1].is_response(response):
+                continue
+            del in_flight[response.id]
+            domain, query, _ = entry
+
+            if response.flags & dns.flags.TC:
+                truncated.append((domain, query))
+                continue
+
+            result = _parse_a_response(domain, query, response)
+            if result is not None:
+                results[domain] = result
+
+    for domain, query in truncated:
+        # Repeat this query over TCP; any failure leaves the domain to the fallback
+        try:
+            response = dns.query.tcp(query, nameserver, timeout=DNS_LIFETIME, port=port)
+        except Exception:
+            continue
+        result = _parse_a_response(domain, query, response)
+        if result is not None:
+            results[domain] = result
+
+    return results
+
+async def _resolve_one(resolver, semaphore, domain):
+    """
+    Resolve a single domain to its A records.
+    Returns an (ips, ttl, error) tuple so failures can be reported by the caller.
+    The ttl is None for failures that should not be cached, such as timeouts.
+    """
+    import dns.resolver
+
+    try:
+        async with semaphore:
+            answers = await resolver.resolve(domain, 'A')
+        return [str(answer) for answer in answers], answers.rrset.ttl, None
+    except (dns.resolver.NXDOMAIN, dns.resolver.NoAnswer) as e:
+        return [], NEGATIVE_CACHE_TTL, f"Failed to resolve domain {domain}: {e}"
+    except Exception as e:
+        return [], None, f"Failed to resolve domain {domain}: {e}"
+
+async def _resolve_all(resolver, domains):
+    """
+    Resolve all domains concurrently on a single event loop, sharing one resolver.
+    """
+    import asyncio
+
+    semaphore = asyncio.Semaphore(MAX_CONCURRENT_QUERIES)
+    tasks = [_resolve_one(resolver, semaphore, domain) for domain in domains]
+    return await asyncio.gather(*tasks)
+
+@functools.lru_cache(maxsize=4096)
+def _split_domain_cidr(domain_with_cidr, default_prefix):
+    """
+    Split a "domain.com,/24" entry into its domain and integer prefix length,
+    using the default prefix if none is given. The domain may also be given as a URL.
+    A CIDR given on the line is normalized the same way as the --class option.
+    """
+    parts = domain_with_cidr.split(',')
+    domain = extract_domain(parts[0].strip())
+    prefix = ip_class_to_prefix(parts[1].strip()) if len(parts) > 1 else default_prefix
+    return domain, prefix
+
+@functools.lru_cache(maxsize=4096)
+def _is_ip_literal(domain):
+    """
+    Check whether a domain entry is already an IPv4 address.
+    """
+    try:
+        ipaddress.IPv4Address(domain)
+        return True
+    except ValueError:
+        return False
+
+def _chunks(items, size):
+    """
+    Split an iterable into lists of at most size items.
+    """
+    iterator = iter(items)
+    while chunk := list(itertools.islice(iterator, size)):
+        yield chunk
+
+def resolve_domains(domains_with_cidr, default_prefix, cache_file=DNS_CACHE_FILE, jobs=1):
     """
-    Resolve a list of domains to their IP addresses and format them with the specified class.
+    Resolve an iterable of domains to their IP addresses, paired with the default prefix length.
     Each domain can optionally include a CIDR (e.g., "domain.com,/24").
+    Returns a set of (integer IPv4 address, prefix length) tuples.
+    Lookups are pipelined over a single UDP socket since they are I/O bound,
+    with the async resolver as a fallback for any that do not get a clear answer.
+    Results are cached in cache_file until their TTL expires; pass None to disable the cache.
+    With jobs > 1, the lookups are split into chunks that are pipelined in parallel.
     """
     resolved_ips = set()
-    for domain_with_cidr in domains_with_cidr:
-        # Split domain and optional CIDR
-        parts = domain_with_cidr.split(',')
-        domain = parts[0].strip()
-        ip_class = parts[1].strip() if len(parts) > 1 else default_ip_class
 
+    # Split each entry into domain and optional CIDR, dropping repeated entries
+    entries = dict.fromkeys(_split_domain_cidr(d, default_prefix) for d in domains_with_cidr)
+
+    # Only query domains that are not already cached, including cached failures
+    cache = _load_dns_cache(cache_file) if cache_file else {}
+    pending = []
+    for domain in dict.fromkeys(domain for domain, _ in entries):
+        if _is_ip_literal(domain):
+            continue
+        if domain not in cache:
+            pending.append(domain)
+        elif "error" in cache[domain]:
+            print(f"{cache[domain]['error']} (cached)", file=sys.stderr)
+
+    if pending:
+        # Imported here so --help, warm-cache and --ips-from runs don't pay to load dnspython
+        import asyncio
+        from concurrent.futures import ThreadPoolExecutor
+        import dns.asyncresolver
+        import dns.exception
+        import dns.resolver
+
+        # One resolver is shared by every lookup, so the system configuration is only read once
         try:
-            answers = dns.resolver.resolve(domain, 'A')
-            for answer in answers:
-                resolved_ips.add(f"{answer}{ip_class}")
-        except Exception as e:
-            print(f"Failed to resolve domain {domain}: {e}", file=sys.stderr)
+            resolver = dns.asyncresolver.Resolver()
+        except dns.exception.DNSException as e:
+            print(f"Error reading the system DNS configuration: {e}", file=sys.stderr)
+            sys.exit(1)
+        resolver.lifetime = DNS_LIFETIME
+        resolver.cache = dns.resolver.LRUCache(max_size=RESOLVER_CACHE_SIZE)
+
+        now = time.time()
+        # Send everything over UDP first, then retry any stragglers with the full resolver.
+        # With several jobs, each worker pipelines its own chunk over its own socket, and
+        # MAX_CONCURRENT_QUERIES is shared between them so the upstream limit still holds.
+        chunk_size = max(-(-len(pending) // jobs), MIN_JOB_CHUNK)
+        max_in_flight = max(1, MAX_CONCURRENT_QUERIES // jobs)
+        results = {}
+        with ThreadPoolExecutor(max_workers=jobs) as executor:
+            for chunk_results in executor.map(lambda chunk: _resolve_pipelined(resolver, chunk, max_in_flight),
+                                              _chunks(pending, chunk_size)):
+                results.update(chunk_results)
+        retry = [domain for domain in pending if domain not in results]
+        if retry:
+            results.update(zip(retry, asyncio.run(_resolve_all(resolver, retry))))
+        for domain in pending:
+            ips, ttl, error = results[domain]
+            if error:
+                print(error, file=sys.stderr)
+            if ttl is None:
+                continue
+            cache[domain] = {"ips": ips, "expires": now + min(ttl, DNS_CACHE_MAX_TTL)}
+            if error:
+                cache[domain]["error"] = error
+        if cache_file:
+            # Write back at exit so the cache is kept even if a later step fails
+            fresh = {domain: cache[domain] for domain in pending if domain in cache}
+            atexit.register(_save_dns_cache, fresh, cache_file)
+
+    # Keep addresses as (integer IP, prefix length) pairs; they are only formatted for output
+    for domain, prefix in entries:
+        if _is_ip_literal(domain):
+            # Already an address, so there is nothing to look up
+            resolved_ips.add((int(ipaddress.IPv4Address(domain)), prefix))
+        elif domain in cache:
+            resolved_ips.update((int(ipaddress.IPv4Address(ip)), prefix) for ip in cache[domain]["ips"])
     return resolved_ips
 
+@functools.lru_cache(maxsize=4096)
 def extract_domain(url_or_domain):
     """
     Extract the domain from a URL or return the input if it's already a domain.
+    Any port or credentials in the URL are dropped, since only the host name can be resolved.
     """
-    parsed = urlparse(url_or_domain)
-    return parsed.netloc if parsed.netloc else url_or_domain
+    # Bare domains are by far the common case, so skip URL parsing for them
+    if '://' not in url_or_domain:
+        return url_or_domain
+    from urllib.parse import urlparse
+    try:
+        return urlparse(url_or_domain).hostname or url_or_domain
+    except ValueError:
+        # Malformed URL (e.g. "http://[bad/"); pass it on so it fails like any other bad domain
+        return url_or_domain
 
-def read_domains_from_file(filename):
+def iter_domains_from_file(filename):
     """
-    Read domains from a file, extract domains from URLs, and return a list of domains.
+    Read domains from a file and yield them one at a time.
     Each line can optionally include a CIDR (e.g., "domain.com,/24").
     Lines starting with '#' or '//' are treated as comments and skipped.
+    The file is streamed, so very large domain lists are never held in memory as a whole.
     """
-    domains = []
     try:
-        with open(filename, 'r') as f:
+        with open(filename, 'rb') as f:
             for line in f:
-                # Strip whitespace and extract domain (with optional CIDR)
-                stripped_line = line.strip()
                 # Skip empty lines and comment lines
-                if stripped_line and not stripped_line.startswith('#') and not stripped_line.startswith('//'):
-                    domains.append(stripped_line)
+                if not SKIP_LINE.match(line):
+                    # Strip whitespace and extract domain (with optional CIDR)
+                    yield line.strip().decode()
+    except Exception as e:
+        print(f"Error reading file {filename}: {e}", file=sys.stderr)
+        sys.exit(1)
+
+def read_domains_from_file(filename):
+    """
+    Read domains from a file, extract domains from URLs, and return a list of domains.
+    Each line can optionally include a CIDR (e.g., "domain.com,/24").
+    Lines starting with '#' or '//' are treated as comments and skipped.
+    The file is read in one go and filtered in a single comprehension, which is faster than
+    iter_domains_from_file for typical lists at the cost of holding the file in memory.
+    """
+    try:
+        with open(filename, 'r', encoding='utf-8') as f:
+            data = f.read()
+    except Exception as e:
+        print(f"Error reading file {filename}: {e}", file=sys.stderr)
+        sys.exit(1)
+    # Skip empty lines and comment lines
+    return [line for line in (raw_line.strip() for raw_line in data.splitlines())
+            if line and line[0] != '#' and not line.startswith('//')]
+
+def read_ips_from_file(filename, default_prefix):
+    """
+    Read already-resolved IPs from a file, or from stdin if filename is '-'.
+    Each line is an IPv4 address with an optional CIDR (e.g., "1.2.3.4/24" or "1.2.3.4,/24");
+    the default prefix length is used if none is given.
+    Blank lines and comment lines are skipped, as in domain files.
+    Returns a set of (integer IPv4 address, prefix length) tuples, like resolve_domains.
+    """
+    allowed_ips = set()
+    try:
+        f = contextlib.nullcontext(sys.stdin.buffer) if filename == '-' else open(filename, 'rb')
+        with f as lines:
+            for line in lines:
+                if SKIP_LINE.match(line):
+                    continue
+                stripped_line = line.strip().decode()
+                # Split off an optional ",/24" CIDR before parsing the address itself
+                address, _, ip_class = stripped_line.partition(',')
+                address = address.strip()
+                try:
+                    if ip_class:
+                        if '/' in address:
+                            raise ValueError("CIDR given twice")
+                        address = f"{address}/{ip_class_to_prefix(ip_class.strip())}"
+                    elif '/' not in address:
+                        address = f"{address}/{default_prefix}"
+                    interface = ipaddress.IPv4Interface(address)
+                except ValueError:
+                    print(f"Invalid IP entry in {filename}: {stripped_line}", file=sys.stderr)
+                    sys.exit(1)
+                allowed_ips.add((int(interface.ip), interface.network.prefixlen))
     except Exception as e:
         print(f"Error reading file {filename}: {e}", file=sys.stderr)
         sys.exit(1)
-    return domains
+    return allowed_ips
 
+@functools.lru_cache(maxsize=4096)
 def normalize_ip_class(ip_class):
     """
     Normalize the IP class input to a valid CIDR notation.
@@ -92,6 +486,115 @@ def normalize_ip_class(ip_class):
 
     return cidr
 
+@functools.lru_cache(maxsize=64)
+def ip_class_to_prefix(ip_class):
+    """
+    Convert an IP class (in any form accepted by normalize_ip_class) to an integer prefix length.
+    """
+    return int(normalize_ip_class(ip_class)[1:])
+
+def collapse_allowed_ips(allowed_ips):
+    """
+    Merge duplicate and contiguous (integer IP, prefix length) entries into the fewest networks,
+    formatted as "ip/cidr" strings and sorted by address.
+    Entries are only merged with others of the same prefix length, so a /32 is never
+    folded into a wider network just because it sits next to one.
+    """
+    buckets = {}
+    for ip, prefix in allowed_ips:
+        buckets.setdefault(prefix, []).append(ipaddress.IPv4Network((ip, prefix), strict=False))
+
+    collapsed = []
+    for networks in buckets.values():
+        collapsed.extend(ipaddress.collapse_addresses(networks))
+    return [str(network) for network in sorted(collapsed)]
+
+def _rewrite_allowed_ips(lines, allowed_ips_line, overwrite, newline=b'\n'):
+    """
+    Yield the lines (as bytes) of a WireGuard config with allowed_ips_line added, in a single pass.
+    In overwrite mode, the new line replaces the first AllowedIPs line and all others are dropped;
+    if there are none, it goes directly after the [Peer] header.
+    In append mode, the new line goes at the end of the first [Peer] section.
+    """
+    in_peer = False
+    emitted = False
+    # In overwrite mode, lines after [Peer] are held back until we know where the new line goes
+    pending = []
+    last_line = b''
+
+    lines = iter(lines)
+    for line in lines:
+        last_line = line
+        # Classify the line once instead of stripping and re-testing it for each check
+        match = CONFIG_LINE.match(line)
+        token = match.lastgroup if match else None
+        if overwrite:
+            if token == 'allowed_ips':
+                if not emitted:
+                    yield from pending
+                    pending = []
+                    yield allowed_ips_line
+                    emitted = True
+            elif in_peer and not emitted:
+                pending.append(line)
+            else:
+                yield line
+                if token == 'peer':
+                    in_peer = True
+        else:
+            if in_peer and token is not None and token != 'allowed_ips':
+                # Insert the new line right before the next section starts,
+                # after which the rest of the file passes through untouched
+                yield allowed_ips_line
+                yield line
+                yield from lines
+                return
+            yield line
+            if token == 'peer':
+                in_peer = True
+
+    if not in_peer and not emitted:
+        print("Error: No [Peer] section found in template", file=sys.stderr)
+        sys.exit(1)
+
+    if not emitted:
+        # No place found earlier, so the new line goes at the end of the [Peer] section
+        # (or, in overwrite mode, directly after the [Peer] header)
+        if not pending and last_line and not last_line.endswith((b'\n', b'\r')):
+            yield newline
+        yield allowed_ips_line
+    yield from pending
+
+def _write_atomically(filename, content):
+    """
+    Write content to filename via a temporary file in the same directory and os.replace,
+    so readers (e.g. a WireGuard reload) never see a partially written config.
+    Symlinks are followed, so the file they point to is replaced rather than the link itself.
+    An existing file's permissions and (where allowed) owner are kept; a new file is
+    created readable only by its owner.
+    """
+    filename = os.path.realpath(filename)
+    directory = os.path.dirname(filename)
+    tmp = tempfile.NamedTemporaryFile('wb', buffering=CONFIG_BUFFER_SIZE, dir=directory,
+                                      prefix=f".{os.path.basename(filename)}.", suffix=".tmp", delete=False)
+    try:
+        with tmp:
+            tmp.write(content)
+            tmp.flush()
+            os.fsync(tmp.fileno())
+        if os.path.exists(filename):
+            shutil.copymode(filename, tmp.name)
+            if hasattr(os, 'chown'):
+                existing = os.stat(filename)
+                # Only possible with enough privileges; otherwise the new file keeps our ownership
+                with contextlib.suppress(OSError):
+                    os.chown(tmp.name, existing.st_uid, existing.st_gid)
+        os.replace(tmp.name, filename)
+    except BaseException:
+        with contextlib.suppress(OSError):
+            os.remove(tmp.name)
+        raise
+
 def update_config(template_file, allowed_ips, output_file=None, overwrite=False):
     """
     Update the AllowedIPs field in the WireGuard config file and output the result.
@@ -99,119 +602,87 @@ def update_config(template_file, allowed_ips, output_file=None, overwrite=False)
     If overwrite is False, append the resolved IPs to the existing AllowedIPs field.
     
     In WireGuard, multiple AllowedIPs lines are concatenated by the client.
+    The template is read and written as bytes in a single call each, keeping its line endings.
     """
-    # Read the template file line by line
     try:
-        with open(template_file, 'r') as f:
-            lines = f.readlines()
+        with open(template_file, 'rb', buffering=CONFIG_BUFFER_SIZE) as f:
+            data = f.read()
     except Exception as e:
         print(f"Error reading template file {template_file}: {e}", file=sys.stderr)
         sys.exit(1)
 
-    # Process based on mode
-    if overwrite:
-        # In overwrite mode, we'll replace all AllowedIPs lines with one new line
-        # Find the position of the first AllowedIPs line to replace it
-        allowed_ips_index = None
-        output_lines = []
-        for i, line in enumerate(lines):
-            if line.strip().startswith('AllowedIPs ='):
-                if allowed_ips_index is None:  # Keep track of the first occurrence
-                    allowed_ips_index = len(output_lines)
-            else:
-                output_lines.append(line)
-                
-        # Format the IPs string
-        ip_str = ', '.join(sorted(allowed_ips))
-        
-        # Insert the new AllowedIPs line at the original position
-        if allowed_ips_index is not None:
-            output_lines.insert(allowed_ips_index, f'AllowedIPs = {ip_str}\n')
-        else:
-            # If no AllowedIPs line was found, add it after the [Peer] section
-            peer_index = None
-            for i, line in enumerate(output_lines):
-                if line.strip() == '[Peer]':
-                    peer_index = i
-                    break
-                    
-            if peer_index is not None:
-                output_lines.insert(peer_index + 1, f'AllowedIPs = {ip_str}\n')
-            else:
-                print("Error: No [Peer] section found in template", file=sys.stderr)
-                sys.exit(1)
-    else:
-        # In append mode, we keep all existing lines (including AllowedIPs lines)
-        # and add a new AllowedIPs line after the peer section
-        output_lines = lines.copy()
-        
-        # Format the IPs string
-        ip_str = ', '.join(sorted(allowed_ips))
-        
-        # Find the [Peer] section
-        peer_index = None
-        for i, line in enumerate(output_lines):
-            if line.strip() == '[Peer]':
-                peer_index = i
-                break
-        
-        # If we found a [Peer] section, add the new line after it
-        if peer_index is not None:
-            # Add the new line after the last entry in the [Peer] section
-            # but before any new section starts
-            next_section_index = len(output_lines)
-            for i in range(peer_index + 1, len(output_lines)):
-                if output_lines[i].strip().startswith('['):
-                    next_section_index = i
-                    break
-            
-            # Insert the new AllowedIPs line right before the next section starts
-            # (or at the end if there's no next section)
-            output_lines.insert(next_section_index, f'AllowedIPs = {ip_str}\n')
-        else:
-            print("Error: No [Peer] section found in template", file=sys.stderr)
-            sys.exit(1)
+    # Match the template's line endings for the lines we add
+    newline = b'\r\n' if b'\r\n' in data else b'\n'
+
+    # Format the IPs string
+    ip_str = ', '.join(collapse_allowed_ips(allowed_ips))
+    allowed_ips_line = f'AllowedIPs = {ip_str}'.encode() + newline
 
-    # Join the lines back to a single string
-    updated_content = ''.join(output_lines)
+    output_lines = _rewrite_allowed_ips(data.splitlines(keepends=True), allowed_ips_line, overwrite, newline)
+    updated_content = b''.join(output_lines)
 
     # Output the updated config
     if output_file:
         try:
-            with open(output_file, 'w') as f:
-                f.write(updated_content)
+            _write_atomically(output_file, updated_content)
             print(f"Updated configuration written to {output_file}")
         except Exception as e:
             print(f"Error writing to output file {output_file}: {e}", file=sys.stderr)
             sys.exit(1)
     else:
-        print(updated_content)
+        # Write the bytes as-is so CRLF templates don't get their line endings translated twice
+        stdout = getattr(sys.stdout, 'buffer', None)
+        if stdout is None:
+            print(updated_content.replace(b'\r\n', b'\n').decode(errors='replace'))
+        else:
+            sys.stdout.flush()
+            stdout.write(updated_content + newline)
+            stdout.flush()
 
 def main():
     # Parse command-line arguments
     parser = argparse.ArgumentParser(description="Update WireGuard config with resolved IPs for domains.")
     parser.add_argument("template_file", help="Path to the base/template WireGuard config file")
-    parser.add_argument("domains", help="Either a single domain or a filename containing domains (one per line, with optional CIDR [example.com{,/24}])")
+    parser.add_argument("domains", nargs="?",
+                        help="Either a single domain or a filename containing domains (one per line, with optional CIDR [example.com{,/24}])")
     parser.add_argument("--class", default="32", dest="ip_class", 
                         help="Default IP class for resolved IPs (default: 32). Use 'A', 'B', 'C', 'HOST', '/32', or numeric values.")
     parser.add_argument("--output", "-o", help="Optional output file for the updated config")
     parser.add_argument("--overwrite", action="store_true", 
                         help="Overwrite the AllowedIPs field instead of appending (default is append).")
+    parser.add_argument("--no-cache", action="store_true",
+                        help="Always query DNS instead of reusing cached results from earlier runs.")
+    parser.add_argument("--jobs", "-j", type=int, default=1,
+                        help="Number of parallel workers used to resolve domains (default: 1).")
+    parser.add_argument("--ips-from", metavar="FILE",
+                        help="Skip DNS and read already-resolved IPs (one per line, with optional CIDR) from FILE, or stdin if FILE is '-'.")
     args = parser.parse_args()
 
-    # Normalize the default IP class
-    default_ip_class = normalize_ip_class(args.ip_class)
+    if args.ips_from and args.domains:
+        parser.error("domains cannot be combined with --ips-from")
+    if not args.ips_from and not args.domains:
+        parser.error("the following arguments are required: domains (or --ips-from)")
+    if args.jobs < 1:
+        parser.error("--jobs must be at least 1")
+
+    # Normalize the default IP class once, as an integer prefix length
+    default_prefix = ip_class_to_prefix(args.ip_class)
 
-    # Determine if the domains argument is a file or a single domain
-    if os.path.isfile(args.domains):
-        # It's a file; read domains from it
-        domains_with_cidr = read_domains_from_file(args.domains)
+    if args.ips_from:
+        # IPs were resolved upstream, so no DNS lookups are needed
+        resolved_ips = read_ips_from_file(args.ips_from, default_prefix)
     else:
-        # Treat it as a single domain (with optional CIDR)
-        domains_with_cidr = [args.domains]
+        # Determine if the domains argument is a file or a single domain
+        if os.path.isfile(args.domains):
+            # It's a file; read domains from it
+            domains_with_cidr = read_domains_from_file(args.domains)
+        else:
+            # Treat it as a single domain (with optional CIDR)
+            domains_with_cidr = [args.domains]
 
-    # Resolve domains to IPs
-    resolved_ips = resolve_domains(domains_with_cidr, default_ip_class)
+        # Resolve domains to IPs
+        cache_file = None if args.no_cache else DNS_CACHE_FILE
+        resolved_ips = resolve_domains(domains_with_cidr, default_prefix, cache_file, args.jobs)
 
     if not resolved_ips:
         print("No IPs resolved. Exiting.", file=sys.stderr)
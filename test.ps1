@@ -22,6 +22,7 @@ $Domain = "example.com"
 $MultipleDomainsFile = "domains.txt"
 $InvalidDomain = "invalid-domain.example"
 $InvalidIPClass = "/48"
+$UrlDomain = "https://example.com/some/page"
 
 # Step 3: Create a temporary WireGuard template file
 Write-Host "Creating temporary WireGuard template file..."
@@ -44,6 +45,7 @@ Write-Host "Creating a file with multiple domains..."
 example.com
 google.com
 github.com
+https://www.wikipedia.org/wiki/Main_Page
 "@ | Set-Content -Path $MultipleDomainsFile
 
 # Step 5: Run the Python program with a single domain
@@ -248,7 +250,59 @@ if ($LASTEXITCODE -ne 0) {
     }
 }
 
-# Step 13: Clean up temporary files
+# Step 13: Test pre-resolved IPs read from stdin
+Write-Host "Running test 8: Pre-resolved IPs with --ips-from..."
+
+# Create a fresh template file first
+@"
+[Interface]
+PrivateKey = [REDACTED]=
+Address = 192.168.2.1/32
+DNS = 1.1.1.1
+
+[Peer]
+PublicKey = [REDACTED]=
+AllowedIPs = 192.168.1.1/32, 10.0.0.0/8
+Endpoint = example.com:51820
+PersistentKeepalive = 25
+"@ | Set-Content -Path $TemplateFile
+
+# Cover all three line forms: a bare IP, "ip/cidr" and "ip,/cidr"
+@"
+192.0.2.9
+198.51.100.7/16
+203.0.113.5,/24
+"@ | uv run $UVScript $TemplateFile --ips-from - --class 32 --output $OutputFile
+if ($LASTEXITCODE -ne 0) {
+    Write-Host "** FAIL ** Test 8 failed: Error running the program with --ips-from." -ForegroundColor Red
+    $TestFailed = $true
+} else {
+    $content = Get-Content -Path $OutputFile -Raw
+
+    $hasBareIP = $content -match "192\.0\.2\.9/32"
+    $hasSlashCIDR = $content -match "198\.51\.0\.0/16"
+    $hasCommaCIDR = $content -match "203\.0\.113\.0/24"
+
+    if ($hasBareIP -and $hasSlashCIDR -and $hasCommaCIDR) {
+        Write-Host "** OK ** Test 8 passed: Pre-resolved IPs processed correctly." -ForegroundColor Green
+    } else {
+        Write-Host "** FAIL ** Test 8 failed: Not all pre-resolved IPs were written correctly." -ForegroundColor Red
+        Write-Host "Debug - Bare IP: $hasBareIP, ip/cidr: $hasSlashCIDR, ip,/cidr: $hasCommaCIDR" -ForegroundColor Yellow
+        $TestFailed = $true
+    }
+}
+
+# Step 14: Test a URL given in place of a domain
+Write-Host "Running test 9: URL '$UrlDomain' instead of a bare domain..."
+uv run $UVScript $TemplateFile $UrlDomain --class 32 --output $OutputFile
+if ($LASTEXITCODE -ne 0) {
+    Write-Host "** FAIL ** Test 9 failed: The host name was not extracted from the URL." -ForegroundColor Red
+    $TestFailed = $true
+} else {
+    Write-Host "** OK ** Test 9 passed: Successfully resolved the host name from a URL." -ForegroundColor Green
+}
+
+# Step 15: Clean up temporary files
 Write-Host "Cleaning up temporary files..."
 Remove-Item -Path $TemplateFile -ErrorAction SilentlyContinue
 Remove-Item -Path $OutputFile -ErrorAction SilentlyContinue